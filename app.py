@@ -1,6 +1,15 @@
+import html
 import os
-import json
+import random
+import re
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 from dotenv import load_dotenv
 
@@ -19,30 +28,105 @@ TAROT_API_URL = "https://tarotapi.dev/api/v1"
 # Base URL for public-domain Rider-Waite card images (sacred-texts.com)
 TAROT_IMAGE_BASE = "https://www.sacred-texts.com/tarot/pkt/img"
 
+# Local copies of the card images, downloaded on first run
+CARD_IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "cards")
+
+SPOTIFY_ACCOUNTS_URL = "https://accounts.spotify.com"
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+
+
+@st.cache_resource
+def _http_session() -> requests.Session:
+    """Shared keep-alive session so repeated API calls reuse pooled connections."""
+    session = requests.Session()
+    session.headers.update({"User-Agent": "tarot-music/1"})
+    for host in (
+        "https://api.groq.com",
+        "https://tarotapi.dev",
+        SPOTIFY_ACCOUNTS_URL,
+        "https://api.spotify.com",
+    ):
+        session.mount(host, HTTPAdapter(pool_connections=8, pool_maxsize=8))
+    return session
+
+
+SESSION = _http_session()
+
 CONTEXTS = [
     "Career", "Love", "Health", "Spirituality",
     "Finances", "Family", "Creativity", "Personal Growth",
 ]
 
 
-def draw_tarot_cards(n: int = 3) -> list[dict]:
-    """Draw n random tarot cards from the Tarot API."""
-    resp = requests.get(f"{TAROT_API_URL}/cards/random", params={"n": n})
+@st.cache_data(ttl=86400, show_spinner=False)
+def _load_deck() -> list[dict]:
+    """Fetch the full 78-card deck from the Tarot API (cached for a day)."""
+    resp = SESSION.get(f"{TAROT_API_URL}/cards")
     resp.raise_for_status()
-    return resp.json()["cards"]
+    return orjson.loads(resp.content)["cards"]
+
+
+def draw_tarot_cards(n: int = 3) -> list[dict]:
+    """Draw n random tarot cards from the locally cached deck."""
+    return random.sample(_load_deck(), n)
+
+
+def _download_card_image(name_short: str) -> bool:
+    """Save one card image into CARD_IMAGE_DIR unless it is already there.
+
+    Returns False if the download failed.
+    """
+    path = os.path.join(CARD_IMAGE_DIR, f"{name_short}.jpg")
+    if os.path.exists(path):
+        return True
+    try:
+        resp = SESSION.get(f"{TAROT_IMAGE_BASE}/{name_short}.jpg")
+        resp.raise_for_status()
+    except requests.RequestException:
+        return False  # card_image() falls back to the remote URL
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(resp.content)
+    os.replace(tmp_path, path)
+    return True
+
+
+@st.cache_resource(show_spinner=False)
+def _prefetch_card_images() -> None:
+    """Download every card image in the deck once per process.
+
+    Raises if any download failed, so the result is not cached and the
+    next draw retries the missing images.
+    """
+    os.makedirs(CARD_IMAGE_DIR, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        ok = list(ex.map(_download_card_image, [c["name_short"] for c in _load_deck()]))
+    failed = ok.count(False)
+    if failed:
+        raise RuntimeError(f"{failed} card image(s) failed to download")
+
+
+def card_image(card: dict) -> str:
+    """Return the local image path for a card, or its remote URL if not yet downloaded."""
+    path = os.path.join(CARD_IMAGE_DIR, f"{card['name_short']}.jpg")
+    if os.path.exists(path):
+        return path
+    return f"{TAROT_IMAGE_BASE}/{card['name_short']}.jpg"
 
 # ── Helper functions ────────────────────────────────────────────────────────
 
-def build_prompt(cards: list[str], context: str) -> str:
-    return f"""
-You are a reflective assistant combining tarot symbolism and music psychology.
-You do not predict the future. You provide grounded, introspective interpretations.
+# Prefix of the final response line that carries the comma-separated genres
+GENRES_MARKER = "Genre tags:"
 
-Tarot cards drawn:
-{', '.join(cards)}
+# The marker only counts at the start of a line, optionally bolded
+_GENRES_LINE_RE = re.compile(
+    r"(?:^|\n)[ \t]*(?:\*\*)?[ \t]*" + re.escape(GENRES_MARKER), re.IGNORECASE
+)
 
-Context:
-{context}
+# Static instructions, sent as an identical system message on every request
+_SYSTEM_MSG = f"""\
+You are a reflective assistant combining tarot symbolism and music psychology.
+You do not predict the future. You provide grounded, introspective interpretations.
 
 Tasks:
 1. Interpret the tarot reading
@@ -50,30 +134,112 @@ Tasks:
 3. Recommend 3 music genres or styles
 4. Explain why each recommendation fits
 
-Respond clearly and thoughtfully.
+Respond clearly and thoughtfully in Markdown.
+On the final line, write "{GENRES_MARKER}" followed by the 3 genre names,
+lowercase and comma-separated, nothing else.
 """
 
 
-def get_tarot_reading(cards: list[str], context: str) -> str:
-    """Send the tarot prompt to Groq and return the LLM response text."""
-    prompt = build_prompt(cards, context)
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": "llama-3.1-8b-instant",
-        "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 512,
-        "temperature": 0.7,
-    }
-    resp = requests.post(GROQ_API_URL, headers=headers, json=payload)
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"]
+def build_prompt(cards: list[str], context: str) -> str:
+    return f"""\
+Tarot cards drawn:
+{', '.join(cards)}
 
+Context:
+{context}
+"""
 
-def extract_genres(reading_text: str) -> list[str]:
-    """Ask the LLM to extract genre names from the reading as a JSON list."""
+
+def _genre_items(rest: str) -> list[str]:
+    """Return the raw genre items from the text after the marker.
+
+    Only the comma-separated line right after the marker (or a bullet list
+    starting on the next line) is used; anything after it is ignored.
+    """
+    same_line, _, below = rest.lstrip(" *").partition("\n")
+    if same_line.strip():
+        return same_line.split(",")
+    items = []
+    for line in (line.strip() for line in below.splitlines()):
+        if not line and not items:
+            continue
+        if not line.startswith(("-", "*")):
+            break
+        items.append(line)
+    return items
+
+
+def parse_reading(text: str) -> tuple[str, list[str]]:
+    """Split the LLM response into the reading and its trailing genre list.
+
+    >>> parse_reading("Reading\\nGenre tags: ambient, jazz, lo-fi\\n\\nI hope this helps you reflect.")
+    ('Reading', ['ambient', 'jazz', 'lo-fi'])
+    >>> parse_reading("Reading\\nGenre Tags:\\n- ambient\\n- jazz\\n- lo-fi")
+    ('Reading', ['ambient', 'jazz', 'lo-fi'])
+    """
+    matches = list(_GENRES_LINE_RE.finditer(text))
+    if not matches:
+        return text.strip(), []
+    last = matches[-1]
+    genres = [
+        g.strip().lstrip("-*").strip(" .*").lower()
+        for g in _genre_items(text[last.end():])
+    ]
+    return text[:last.start()].rstrip(), [g for g in genres if g][:3]
+
+
+@st.cache_resource
+def _reading_cache() -> tuple[dict, threading.Lock]:
+    """Process-wide (cards, context) -> (expires_at, reading, genres) memo and its lock."""
+    return {}, threading.Lock()
+
+
+def _store_reading(key: tuple, reading: str, genres: list[str]) -> None:
+    """Memoize a reading for an hour, evicting expired then oldest entries past 256."""
+    cache, lock = _reading_cache()
+    now = time.time()
+    with lock:
+        for k in [k for k, v in cache.items() if v[0] <= now]:
+            cache.pop(k, None)
+        while len(cache) >= 256:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = (now + 3600, reading, genres)
+
+
+def _held_back(text: str) -> int:
+    """Return how many trailing characters of text could be the start of GENRES_MARKER."""
+    marker = GENRES_MARKER.lower()
+    text = text.lower()
+    for k in range(min(len(marker) - 1, len(text)), 0, -1):
+        if text.endswith(marker[:k]):
+            return k
+    return 0
+
+
+def _safe_end(text: str) -> int:
+    """Return how much of the streamed text can be shown without leaking the genre line."""
+    match = _GENRES_LINE_RE.search(text)
+    end = match.start() if match else len(text) - _held_back(text)
+    # Also hold back trailing whitespace and "*" in case the marker line is bolded
+    return len(text[:end].rstrip(" \t\r\n*"))
+
+
+def stream_tarot_reading(cards: list[str], context: str, result: dict) -> Iterator[str]:
+    """Stream the tarot reading from Groq, yielding text as it arrives.
+
+    The trailing genre line is not yielded. Once the generator is exhausted,
+    ``result`` holds the parsed ``reading`` and ``genres``. Repeat draws of
+    the same cards and context are served from a one-hour cache.
+    """
+    key = (tuple(sorted(cards)), context)
+    cache, _ = _reading_cache()
+    hit = cache.get(key)
+    if hit and time.time() < hit[0]:
+        result["reading"], result["genres"] = hit[1], hit[2]
+        yield hit[1]
+        return
+
+    prompt = build_prompt(list(key[0]), context)
     headers = {
         "Authorization": f"Bearer {GROQ_API_KEY}",
         "Content-Type": "application/json",
@@ -81,28 +247,57 @@ def extract_genres(reading_text: str) -> list[str]:
     payload = {
         "model": "llama-3.1-8b-instant",
         "messages": [
-            {
-                "role": "user",
-                "content": (
-                    "From the following text, extract ONLY the music genre/style names "
-                    "as a JSON list of strings. Return ONLY the JSON array, nothing else.\n\n"
-                    + reading_text
-                ),
-            }
+            {"role": "system", "content": _SYSTEM_MSG},
+            {"role": "user", "content": prompt},
         ],
-        "max_tokens": 100,
-        "temperature": 0.0,
+        "max_tokens": 640,
+        "temperature": 0.7,
+        "stream": True,
     }
-    resp = requests.post(GROQ_API_URL, headers=headers, json=payload)
-    resp.raise_for_status()
-    raw = resp.json()["choices"][0]["message"]["content"].strip()
-    return json.loads(raw)
+    text = ""
+    emitted = 0
+    with SESSION.post(GROQ_API_URL, headers=headers, json=payload, stream=True) as resp:
+        resp.raise_for_status()
+        # Read raw bytes: requests would decode a charset-less event stream as Latin-1
+        for line in resp.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[len(b"data: "):]
+            if data == b"[DONE]":
+                break
+            text += orjson.loads(data)["choices"][0]["delta"].get("content") or ""
+
+            safe_end = _safe_end(text)
+            if safe_end > emitted:
+                yield text[emitted:safe_end]
+                emitted = safe_end
+
+    reading, genres = parse_reading(text)
+    if emitted < len(reading):
+        yield reading[emitted:]
+    result["reading"], result["genres"] = reading, genres
+    if not genres:
+        return  # truncated or missing genre line; let the next draw retry
+    _store_reading(key, reading, genres)
+
+
+@st.cache_resource
+def _spotify_token_cache() -> dict:
+    """Process-wide holder for the Spotify token; survives Streamlit reruns."""
+    return {"token": None, "expires_at": 0.0}
 
 
 def get_spotify_token() -> str:
-    """Obtain a Spotify access token via Client Credentials flow."""
-    resp = requests.post(
-        "https://accounts.spotify.com/api/token",
+    """Obtain a Spotify access token via Client Credentials flow.
+
+    The token is cached until 60 seconds before it expires.
+    """
+    cache = _spotify_token_cache()
+    if cache["token"] and time.time() < cache["expires_at"] - 60:
+        return cache["token"]
+
+    resp = SESSION.post(
+        f"{SPOTIFY_ACCOUNTS_URL}/api/token",
         data={
             "grant_type": "client_credentials",
             "client_id": SPOTIFY_CLIENT_ID,
@@ -110,36 +305,59 @@ def get_spotify_token() -> str:
         },
     )
     resp.raise_for_status()
-    return resp.json()["access_token"]
+    data = orjson.loads(resp.content)
+    cache["token"] = data["access_token"]
+    cache["expires_at"] = time.time() + data.get("expires_in", 3600)
+    return cache["token"]
+
+
+def _search_one_genre(
+    genre: str, session: requests.Session, headers: dict, limit: int
+) -> list[dict]:
+    """Search Spotify for tracks in one genre, falling back to a plain keyword query."""
+    url = f"{SPOTIFY_API_URL}/search"
+    params = {"q": f"genre:{genre}", "type": "track", "limit": limit}
+    resp = session.get(url, headers=headers, params=params)
+    resp.raise_for_status()
+    tracks = orjson.loads(resp.content).get("tracks", {}).get("items", [])
+
+    if not tracks:
+        params["q"] = genre
+        resp = session.get(url, headers=headers, params=params)
+        resp.raise_for_status()
+        tracks = orjson.loads(resp.content).get("tracks", {}).get("items", [])
+
+    return [
+        {
+            "id": t["id"],
+            "name": t["name"],
+            "artist": t["artists"][0]["name"],
+            "genre": genre,
+            "url": t["external_urls"]["spotify"],
+        }
+        for t in tracks
+    ]
 
 
 def search_tracks(genres: list[str], token: str, limit: int = 3) -> list[dict]:
-    """Search Spotify for tracks matching each genre."""
-    url = "https://api.spotify.com/v1/search"
-    headers = {"Authorization": f"Bearer {token}"}
-    all_tracks = []
-
-    for genre in genres:
-        params = {"q": f"genre:{genre}", "type": "track", "limit": limit}
-        resp = requests.get(url, headers=headers, params=params)
-        tracks = resp.json().get("tracks", {}).get("items", [])
-
-        if not tracks:
-            params["q"] = genre
-            resp = requests.get(url, headers=headers, params=params)
-            tracks = resp.json().get("tracks", {}).get("items", [])
-
-        for t in tracks:
-            all_tracks.append(
-                {
-                    "id": t["id"],
-                    "name": t["name"],
-                    "artist": t["artists"][0]["name"],
-                    "genre": genre,
-                    "url": t["external_urls"]["spotify"],
-                }
-            )
-    return all_tracks
+    """Search Spotify for tracks matching each genre, reusing recent results."""
+    # Normalise and drop empty or case-duplicate genres, preserving order
+    genres = list(dict.fromkeys(g.strip().lower() for g in genres if g.strip()))
+    return _search_tracks_cached(tuple(genres), limit, token)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _search_tracks_cached(genres: tuple[str, ...], limit: int, _token: str) -> list[dict]:
+    """Query Spotify for each genre concurrently. `_token` is excluded from the cache key."""
+    if not genres:
+        return []
+    headers = {"Authorization": f"Bearer {_token}"}
+
+    with ThreadPoolExecutor(max_workers=min(len(genres), 8)) as ex:
+        results = list(
+            ex.map(lambda g: _search_one_genre(g, SESSION, headers, limit), genres)
+        )
+    return [track for genre_tracks in results for track in genre_tracks]
 
 
 # ── Streamlit UI ────────────────────────────────────────────────────────────
@@ -186,10 +404,19 @@ if st.button("🃏 Draw Cards & Get Reading", type="primary", use_container_widt
         st.error(f"Missing environment variables: {', '.join(missing)}. Add them to your `.env` file.")
         st.stop()
 
+    # Fetch the cards and the Spotify token concurrently; the token has no
+    # dependency on the reading, so its latency hides behind the LLM call.
+    # Card images are mirrored locally in the background on first run.
+    prefetch = ThreadPoolExecutor(max_workers=3)
+    cards_future = prefetch.submit(draw_tarot_cards, num_cards)
+    token_future = prefetch.submit(get_spotify_token)
+    prefetch.submit(_prefetch_card_images)
+    prefetch.shutdown(wait=False)
+
     # Draw random cards from the Tarot API
     with st.spinner("Drawing cards..."):
         try:
-            drawn_cards = draw_tarot_cards(num_cards)
+            drawn_cards = cards_future.result()
         except Exception as e:
             st.error(f"Error fetching tarot cards: {e}")
             st.stop()
@@ -201,29 +428,19 @@ if st.button("🃏 Draw Cards & Get Reading", type="primary", use_container_widt
     cols = st.columns(num_cards)
     for i, card in enumerate(drawn_cards):
         with cols[i]:
-            img_url = f"{TAROT_IMAGE_BASE}/{card['name_short']}.jpg"
-            st.image(img_url, caption=card["name"], width=150)
+            st.image(card_image(card), caption=card["name"], width=150)
             st.markdown(f"**Upright:** {card['meaning_up']}")
             st.markdown(f"**Reversed:** {card['meaning_rev']}")
 
-    # Get tarot reading from Groq
-    with st.spinner("Consulting the cards..."):
-        try:
-            reading = get_tarot_reading(card_names, context)
-        except Exception as e:
-            st.error(f"Error getting tarot reading: {e}")
-            st.stop()
-
+    # Stream the tarot reading from Groq; recommended genres arrive at the end
     st.subheader("📖 Your Reading")
-    st.markdown(reading)
-
-    # Extract genres
-    with st.spinner("Identifying music genres..."):
-        try:
-            genres = extract_genres(reading)
-        except Exception as e:
-            st.error(f"Error extracting genres: {e}")
-            st.stop()
+    result = {}
+    try:
+        st.write_stream(stream_tarot_reading(card_names, context, result))
+    except Exception as e:
+        st.error(f"Error getting tarot reading: {e}")
+        st.stop()
+    genres = result["genres"]
 
     st.subheader("🎵 Recommended Genres")
     st.write(", ".join(genres))
@@ -231,7 +448,7 @@ if st.button("🃏 Draw Cards & Get Reading", type="primary", use_container_widt
     # Search Spotify and display embedded players
     with st.spinner("Finding tracks on Spotify..."):
         try:
-            token = get_spotify_token()
+            token = token_future.result()
             tracks = search_tracks(genres, token)
         except Exception as e:
             st.error(f"Error searching Spotify: {e}")
@@ -239,14 +456,23 @@ if st.button("🃏 Draw Cards & Get Reading", type="primary", use_container_widt
 
     if tracks:
         st.subheader("🎧 Listen Now")
-        for track in tracks:
-            embed_url = f"https://open.spotify.com/embed/track/{track['id']}?utm_source=generator&theme=0"
-            st.markdown(f"**{track['name']}** — {track['artist']}  `[{track['genre']}]`")
-            st.components.v1.html(
-                f'<iframe src="{embed_url}" width="100%" height="80" '
-                f'frameBorder="0" allow="autoplay; clipboard-write; encrypted-media; '
-                f'fullscreen; picture-in-picture" loading="lazy"></iframe>',
-                height=90,
-            )
+        # One component for all players avoids an extra iframe per track
+        players = "".join(
+            f'<div style="margin-bottom:12px">'
+            f'<p style="margin:0 0 6px; white-space:nowrap; overflow:hidden; '
+            f'text-overflow:ellipsis"><b>{html.escape(t["name"])}</b> — '
+            f'{html.escape(t["artist"])} <code>[{html.escape(t["genre"])}]</code></p>'
+            f'<iframe src="https://open.spotify.com/embed/track/{t["id"]}?utm_source=generator&theme=0" '
+            f'style="display:block" width="100%" height="80" frameBorder="0" '
+            f'allow="autoplay; clipboard-write; encrypted-media; fullscreen; '
+            f'picture-in-picture" loading="lazy"></iframe>'
+            f"</div>"
+            for t in tracks
+        )
+        st.components.v1.html(
+            f'<div style="font-family:sans-serif">{players}</div>',
+            height=120 * len(tracks) + 20,
+            scrolling=True,
+        )
     else:
         st.warning("No tracks found on Spotify for the recommended genres.")